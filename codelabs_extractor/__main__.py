@@ -1,9 +1,7 @@
-from .course_extractor import CourseExtractor
-from .codelab_extractor import MARKDOWN_LINE_BREAK
-from .utils import detectLanguage
-import re
-import os
+from .course_extractor import CourseExtractor, FORMATS
+from .metrics import Metrics, NullMetrics, getMetrics, setMetrics
 import argparse
+import os
 
 def parseArgs(namespace):
 	argParser = argparse.ArgumentParser(fromfile_prefix_chars="@",
@@ -15,21 +13,42 @@ def parseArgs(namespace):
 	argParser.add_argument("-o", "--output-directory", type=str, required=True, metavar="DIR",
 		help="Output directory in which to save all generated files")
 	argParser.add_argument("-f", "--format", type=str, required=True, metavar="FMT",
-		help="The format of the output. Supported FMT values: repr, md, html, pandoc")
+		help=f"The format of the output. Supported FMT values: {', '.join(FORMATS)}")
 	argParser.add_argument("-l", "--language", type=str, default="", metavar="LANG",
 		help="The programming language used in the course,"
 		+ " to use with code blocks whose language could not be automatically detected."
 		+ " Supported LANG values: java, kotlin (and the others supported by Markdown)."
 		+ " Defaults to an empty string (i.e. no syntax highlighting).")
 
+	argParser.add_argument("--download-images", action="store_true",
+		help="Download images into the output directory instead of linking to them online")
+	argParser.add_argument("--max-connections", type=int, default=16, metavar="N",
+		help="The maximum number of parallel downloads from the same host; the actual number adapts"
+		+ " to how fast the host responds and whether it is throttling. Defaults to 16.")
+
+	argParser.add_argument_group("Reporting options")
+	argParser.add_argument("-q", "--quiet", action="store_true",
+		help="Do not report progress, warnings and errors")
+	argParser.add_argument("--log-format", type=str, default="text", choices=["text", "json"],
+		help="Report progress, warnings and errors as text or as json lines. Defaults to text.")
+	argParser.add_argument("--metrics", type=str, required=False, metavar="FILE",
+		help="Save metrics about the run (pages fetched, timings, unknown html elements, ...) to FILE")
+	argParser.add_argument("--metrics-format", type=str, default="prometheus", choices=["prometheus", "json"],
+		help="Save metrics in the Prometheus text format or as json lines. Defaults to prometheus.")
+
 	argParser.add_argument_group("Debugging-related options")
 	argParser.add_argument("--count", type=int, required=False, metavar="N",
 		help="Limit the count of extracted codelabs to the first N")
 	argParser.add_argument("--cache-pages", action="store_true",
 		help="Save downloaded pages to html files or load from them if they already exist")
+	argParser.add_argument("--cache-extracted", action="store_true",
+		help="Save the extracted course to a file or load from it if it already exists,"
+		+ " skipping downloading and extracting")
 
 	argParser.parse_args(namespace=namespace)
 
+	if namespace.max_connections < 1:
+		argParser.error("--max-connections must be at least 1")
 	if namespace.count is None:
 		namespace.count = 999999 # infinity
 
@@ -37,26 +56,36 @@ def main():
 	class Args: pass
 	parseArgs(Args)
 
-	course = CourseExtractor(Args.course, Args.language, Args.count,
-		Args.output_directory if Args.cache_pages else None)
-
-	if Args.format == "pandoc":
-		course.pandoc(Args.output_directory)
+	if Args.quiet and Args.metrics is None:
+		setMetrics(NullMetrics())
 	else:
-		os.makedirs(Args.output_directory, exist_ok=True)
-		def open_file(filename: str):
-			return open(os.path.join(Args.output_directory, filename), "w")
-
-		if   Args.format == "repr":
-			for i in range(len(course.codelabs)):
-				with open_file(f"{i}.txt") as f:
-					f.write(repr(course.codelabs[i]))
-		elif Args.format == "md":
-			for i in range(len(course.codelabs)):
-				with open_file(f"{i}.md") as f:
-					f.write(MARKDOWN_LINE_BREAK.join(course.codelabs[i].markdown_pages()))
-		else:
-			print(f"ERR: unknown format {Args.format}")
+		setMetrics(Metrics(None if Args.quiet else Args.log_format))
+	from .scheduler import FetchScheduler, setScheduler # not needed for --help
+	setScheduler(FetchScheduler(max_limit=Args.max_connections))
+
+	# identical warnings and errors are only reported once per run
+	with getMetrics().run():
+		extracted_path = os.path.join(Args.output_directory, "extracted_course.pickle")
+		course = None
+		if Args.cache_extracted and os.path.exists(extracted_path):
+			course = CourseExtractor.load(extracted_path, CourseExtractor.extraction_arguments(
+				Args.course, Args.language, Args.count, Args.download_images))
+
+		if course is None:
+			course = CourseExtractor(Args.course, Args.language, Args.count,
+				Args.output_directory if Args.cache_pages else None, download_images=Args.download_images)
+			if Args.cache_extracted:
+				os.makedirs(Args.output_directory, exist_ok=True)
+				course.save(extracted_path)
+
+		try:
+			course.export(Args.format, Args.output_directory)
+		except ValueError as e:
+			getMetrics().error(str(e))
+
+	if Args.metrics is not None:
+		with open(Args.metrics, "w") as f:
+			f.write(getMetrics().prometheus() if Args.metrics_format == "prometheus" else getMetrics().json_lines())
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
@@ -1,15 +1,27 @@
-from bs4 import BeautifulSoup as Html
-from bs4.element import NavigableString
-from .utils import getPageHtml, firstMatchRegex, optionalGet, stripNonLetters
+from __future__ import annotations # so that `Html` annotations are not evaluated at runtime
+from .utils import getPageHtml, firstMatchRegex, optionalGet, stripNonLetters, escapeXml, LRUCache
 from .elements import *
+from .metrics import getMetrics
+from collections import Counter
 import re
 import os
 
-MARKDOWN_LINE_BREAK = "\n<div style=\"page-break-after: always; visibility: hidden\">\n\\pagebreak\n</div>\n\n"
+# bs4 is slow to import and is not needed by extracted codelabs (e.g. when loaded from a
+# pickle), so it is imported by setup_func_table when the first codelab is downloaded; type
+# checkers treat TYPE_CHECKING as True, and defining it here avoids importing typing
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+	from bs4 import BeautifulSoup as Html
 
 class CodelabExtractor:
+	func_table = None # built on first use by setup_func_table
+	NavigableString = None # bs4.element.NavigableString, set by setup_func_table
+
 	@classmethod
 	def setup_func_table(cls):
+		from bs4.element import NavigableString
+		cls.NavigableString = NavigableString
+
 		cls.func_table = {
 			'google-codelab-step': cls.step,
 			'p': cls.p,
@@ -57,13 +69,17 @@ class CodelabExtractor:
 		return func
 
 
-	def __init__(self, url: str, default_code_language: str, cache_pages_directory: str):
+	def __init__(self, url: str, default_code_language: str, cache_pages_directory: str, page_cache: LRUCache = None):
+		if CodelabExtractor.func_table is None:
+			CodelabExtractor.setup_func_table()
+
 		self.default_code_language = default_code_language
-		html = getPageHtml(url, cache_pages_directory)
+		html = getPageHtml(url, cache_pages_directory, page_cache)
 		self.codelabHtml = html.body.find('google-codelab')
 
 		self.extract_base_url(url)
 		self.extract_metadata()
+		self.extract_image_urls()
 
 
 	def __repr__(self):
@@ -81,6 +97,10 @@ class CodelabExtractor:
 			self.steps[:(None if self.next_url is None else -1)]]
 		return [titlePage] + stepPages
 
+	def html(self) -> str:
+		return (f"<h1>{self.chapter} {escapeXml(self.short_title)}</h1>"
+			+ "".join([step.html() for step in self.steps]))
+
 	def pandoc(self) -> str:
 		return (f"# {self.chapter} {self.short_title}\n"
 			+ "\n".join([step.pandoc() for step in self.steps]))
@@ -97,12 +117,12 @@ class CodelabExtractor:
 		self.title = self.codelabHtml['title']
 		self.chapter = firstMatchRegex(self.title, r"0*([1-9][0-9]*\.[0-9]+)")
 		if self.chapter is None:
-			print(f"WARN: could not extract chapter from {self.title}")
+			getMetrics().warning(f"could not extract chapter from {self.title}")
 			self.chapter = ""
 
 		self.short_title = firstMatchRegex(self.title, r"[\.\:](.+)$")
 		if self.short_title is None:
-			print(f"WARN: could not extract short title from {self.title}")
+			getMetrics().warning(f"could not extract short title from {self.title}")
 			self.short_title = self.title
 		else:
 			self.short_title = stripNonLetters(self.short_title)
@@ -116,25 +136,55 @@ class CodelabExtractor:
 			self.next_title = None
 			self.next_url = None
 
-	def extract_steps(self, all_codelab_ids: list):
+	def extract_image_urls(self):
+		self.image_urls = []
+		for stepHtml in self.codelabHtml.find_all('google-codelab-step'):
+			for imgHtml in stepHtml.find_all('img'):
+				src = optionalGet(imgHtml, "src")
+				if src is not None and self.image_url(src) not in self.image_urls:
+					self.image_urls.append(self.image_url(src))
+
+	def image_url(self, src: str) -> str:
+		if src.startswith("http") or src.startswith("www"):
+			return src
+		else:
+			return self.base_url + src
+
+	def extract_steps(self, all_codelab_ids: list, image_paths: dict = None):
 		stepsHtml = self.codelabHtml.find_all('google-codelab-step')
 		self.steps = []
 		self.all_codelab_ids = all_codelab_ids
+		self.image_paths = image_paths or {} # image url -> path of the downloaded image
+		# counted locally and reported once, to keep parse_element cheap
+		self.nodes_built = 0
+		self.unknown_tags = Counter()
 
 		for i in range(len(stepsHtml)):
 			self.steps.append(self.step(stepsHtml[i], i+1))
 
+		# the extracted steps do not reference the html anymore, and dropping it keeps
+		# the extracted codelab free of bs4 objects (e.g. to pickle it)
+		del self.codelabHtml
+
+		metrics = getMetrics()
+		metrics.count("nodes_built_total", self.nodes_built)
+		for tag, count in self.unknown_tags.items():
+			metrics.count("unknown_tags_total", count, tag=tag)
+			metrics.error(f"unknown html element: {tag}")
+
 
 	def parse_element(self, obj: Html) -> Element:
-		if isinstance(obj, NavigableString):
-			return Text(obj.string)
+		if isinstance(obj, self.NavigableString):
+			self.nodes_built += 1
+			return Text(str(obj)) # not the NavigableString itself, to keep bs4 out of the extracted tree
 		if obj is None or obj.name is None:
 			return None
 
 		if obj.name in self.func_table:
+			self.nodes_built += 1
 			return self.func_table[obj.name](self, obj)
 		else:
-			print(f"ERR: unknown html element: {obj.name}")
+			self.unknown_tags[obj.name] += 1
 			return None
 
 	def propagate(self, obj: Html, parent: Element) -> Element:
@@ -181,21 +231,14 @@ class CodelabExtractor:
 		return self.propagate(obj, Aside(obj['class'][0]))
 
 	def img(self, obj: Html) -> Image:
-		src = obj["src"]
-		if src.startswith("http") or src.startswith("www"):
-			url = src
-		else:
-			url = self.base_url + src
-
+		url = self.image_url(obj["src"])
 		return Image(
-			url,
+			self.image_paths.get(url, url),
 			firstMatchRegex(optionalGet(obj, "style"), r"width\: ((?:[0-9]*\.)?[0-9]+)px"),
 			optionalGet(obj, "alt"))
 
 	def pre(self, obj: Html) -> Code:
-		return Code(obj, self.default_code_language)
+		return Code(obj.text, str(obj), self.default_code_language)
 
 	def br(self, obj: Html) -> Text:
 		return Text("\n")
-
-CodelabExtractor.setup_func_table()
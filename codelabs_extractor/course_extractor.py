@@ -1,21 +1,107 @@
-from .codelab_extractor import CodelabExtractor
-from .utils import commonStartingSubstring, extractHost, stripNonLetters
+from .elements import Aside
+from .metrics import getMetrics
+from .utils import commonStartingSubstring, extractHost, stripNonLetters, escapeXml, hashedFilename, writePrecompressedFile, importBrotli, localImagePath, LRUCache
 import os
 
+HTML_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link rel="stylesheet" href="./{stylesheet}">
+</head>
+<body>
+<nav><a href="./index.html">{course_title}</a></nav>
+{body}
+</body>
+</html>
+"""
+
+MARKDOWN_LINE_BREAK = "\n<div style=\"page-break-after: always; visibility: hidden\">\n\\pagebreak\n</div>\n\n"
+FORMATS = ["repr", "md", "html", "pandoc"]
+
 class CourseExtractor:
 
-	def __init__(self, url_first_codelab: str, default_code_language: str, codelab_count: int, cache_pages_directory: str):
+	def __init__(self, url_first_codelab: str, default_code_language: str, codelab_count: int, cache_pages_directory: str,
+			page_cache: LRUCache = None, progress = None, download_images: bool = False, image_cache: LRUCache = None):
 		self.url_first_codelab = url_first_codelab
 		self.default_code_language = default_code_language
+		# saved along with the extracted course, to check that a saved course matches the request
+		self.arguments = CourseExtractor.extraction_arguments(url_first_codelab, default_code_language,
+			codelab_count, download_images)
+		self.page_cache = page_cache
+		self.image_cache = image_cache
+		self.progress_callback = progress
+		self.download_images = download_images
 		self.download_codelabs(codelab_count, cache_pages_directory)
 		self.extract_metadata()
+		# before extracting, so that images that could not be downloaded keep their online url
+		self.collect_images()
 		self.extract_all_codelabs()
 
 
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["page_cache"] = None
+		state["image_cache"] = None
+		state["progress_callback"] = None
+		return state
+
+	def save(self, file_path: str):
+		import pickle
+		with open(file_path, "wb") as f:
+			pickle.dump(self, f)
+
+	@staticmethod
+	def extraction_arguments(url_first_codelab: str, default_code_language: str, codelab_count: int, download_images: bool):
+		return {"course": url_first_codelab, "language": default_code_language,
+			"count": codelab_count, "download_images": download_images}
+
+	@staticmethod
+	def load(file_path: str, arguments: dict):
+		"""Returns None if the saved course can't be loaded (e.g. it was saved by an older
+		version) or was extracted with different arguments"""
+		import pickle
+		try:
+			with open(file_path, "rb") as f:
+				course = pickle.load(f)
+		except Exception as e: # e.g. AttributeError for classes changed since, or anything for corrupt files
+			getMetrics().warning(f"could not load extracted course from {file_path}: {e}")
+			return None
+
+		if not hasattr(course, "arguments"):
+			getMetrics().warning(f"extracted course in {file_path} was saved by an older version")
+			return None
+		if course.arguments != arguments:
+			getMetrics().warning(f"extracted course in {file_path} was extracted with different arguments")
+			return None
+		return course
+
 	def __repr__(self):
 		return (f"Course {self.id} \"{self.title}\":\n" +
 			"\n".join([repr(c) for c in self.codelabs]))
 
+	def export(self, format: str, directory: str):
+		if format != "repr":
+			self.write_images(directory)
+
+		if format == "pandoc":
+			self.pandoc(directory)
+		elif format == "html":
+			self.html(directory)
+		elif format in FORMATS:
+			os.makedirs(directory, exist_ok=True)
+			for i in range(len(self.codelabs)):
+				if format == "repr":
+					filename, content = f"{i}.txt", repr(self.codelabs[i])
+				else:
+					filename, content = f"{i}.md", MARKDOWN_LINE_BREAK.join(self.codelabs[i].markdown_pages())
+				with open(os.path.join(directory, filename), "w") as f:
+					f.write(content)
+		else:
+			raise ValueError(f"unknown format {format}")
+
 	def pandoc(self, directory: str):
 		written_files = []
 		os.makedirs(directory, exist_ok=True)
@@ -43,24 +129,110 @@ class CourseExtractor:
 			with open_in_directory(f"{i}.md") as f:
 				f.write(self.codelabs[i].pandoc())
 
-		print("Convert to an ebook using this pandoc command:"
-			+ " pandoc --verbose -o OUTPUT_FILE "
+		getMetrics().event("pandoc_command", command="pandoc --verbose -o OUTPUT_FILE "
+			+ (f"--resource-path {directory} " if self.images else "")
 			+ " ".join(written_files))
 
 
+	def html(self, directory: str, max_workers: int = None):
+		os.makedirs(directory, exist_ok=True)
+
+		# the stylesheet name contains a hash of its content, so it can be cached forever
+		stylesheet = Aside.stylesheet().encode("utf-8")
+		stylesheet_filename = hashedFilename("style.css", stylesheet)
+		course_title = escapeXml(self.title or "")
+		def page(title: str, body: str) -> bytes:
+			return HTML_PAGE_TEMPLATE.format(title=escapeXml(title), stylesheet=stylesheet_filename,
+				course_title=course_title, body=body).encode("utf-8")
+
+		files = {stylesheet_filename: stylesheet}
+		files["index.html"] = page(self.title or "", f"<h1>{course_title}</h1><ol start=\"0\">"
+			+ "".join([f"<li><a href=\"./{i}.html\">{escapeXml(f'{c.chapter} {c.short_title}')}</a></li>"
+				for i, c in enumerate(self.codelabs)])
+			+ "</ol>")
+		for i in range(len(self.codelabs)):
+			codelab = self.codelabs[i]
+			files[f"{i}.html"] = page(f"{codelab.chapter} {codelab.short_title}", codelab.html())
+
+		if importBrotli() is None:
+			getMetrics().warning("the brotli module is not installed, so no precompressed .br files are written")
+		from concurrent.futures import ThreadPoolExecutor
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			# list() so that exceptions raised in workers are propagated
+			list(executor.map(lambda item: writePrecompressedFile(os.path.join(directory, item[0]), item[1]),
+				files.items()))
+
+
+	def progress(self, stage: str, detail: str):
+		getMetrics().progress(stage, detail)
+		if self.progress_callback is not None:
+			self.progress_callback(stage, detail)
+
 	def download_codelabs(self, count: int, cache_pages_directory: bool):
+		# imported here since it depends on bs4, which is only needed to extract codelabs
+		from .codelab_extractor import CodelabExtractor
+
 		last_url = self.url_first_codelab
+		self.image_paths = {} # image url -> path of the downloaded image
+		self.image_downloads = {} # image url -> (Future of the image data, whether it came from image_cache)
 		self.all_codelab_ids = []
 		self.codelabs = []
 
 		while last_url is not None and len(self.codelabs) < count:
-			print("Downloading", last_url)
-			codelab = CodelabExtractor(last_url, self.default_code_language, cache_pages_directory)
+			self.progress("Downloading", last_url)
+			codelab = CodelabExtractor(last_url, self.default_code_language, cache_pages_directory, self.page_cache)
 			self.codelabs.append(codelab)
+			if self.download_images:
+				self.start_image_downloads(codelab.image_urls)
 
 			last_url = codelab.next_url
 			self.all_codelab_ids.append(codelab.id)
 
+	def start_image_downloads(self, image_urls: list):
+		# images are downloaded in the background with a lower priority than pages,
+		# while the next pages are being downloaded
+		from concurrent.futures import Future
+		from .scheduler import getScheduler, PRIORITY_IMAGE
+		for url in image_urls:
+			if url in self.image_downloads:
+				continue
+			data = None if self.image_cache is None else self.image_cache.get(url)
+			if self.image_cache is not None:
+				getMetrics().cache("memory_images", data is not None)
+			if data is None:
+				self.image_downloads[url] = (getScheduler().submit(url, PRIORITY_IMAGE), False)
+			else:
+				cached = Future()
+				cached.set_result(data)
+				self.image_downloads[url] = (cached, True)
+
+	def collect_images(self):
+		metrics = getMetrics()
+		self.images = {} # path of the downloaded image -> image data
+		for url, (download, cached) in self.image_downloads.items():
+			try:
+				data = download.result()
+			except Exception as e:
+				# not added to image_paths, so the image is linked online
+				metrics.error(f"could not download image {url}, linking to it online: {e}")
+				continue
+			self.image_paths[url] = localImagePath(url, data)
+			self.images[self.image_paths[url]] = data
+			if not cached:
+				metrics.count("images_fetched_total")
+				metrics.count("fetched_bytes_total", len(data))
+				if self.image_cache is not None:
+					self.image_cache.put(url, data)
+		# futures can't be pickled
+		del self.image_downloads
+
+	def write_images(self, directory: str):
+		for path, data in self.images.items():
+			file_path = os.path.join(directory, path)
+			os.makedirs(os.path.dirname(file_path), exist_ok=True)
+			with open(file_path, "wb") as f:
+				f.write(data)
+
 	def extract_metadata(self):
 		self.host = extractHost(self.url_first_codelab)
 
@@ -89,5 +261,6 @@ class CourseExtractor:
 
 	def extract_all_codelabs(self):
 		for codelab in self.codelabs:
-			print("Extracting", codelab.short_title)
-			codelab.extract_steps(self.all_codelab_ids)
+			self.progress("Extracting", codelab.short_title)
+			with getMetrics().timer("extract_seconds"):
+				codelab.extract_steps(self.all_codelab_ids, self.image_paths)
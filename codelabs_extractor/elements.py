@@ -1,5 +1,5 @@
-from bs4 import BeautifulSoup as Html
 from .utils import detectLanguage, escapeXml
+from .metrics import getMetrics
 import re
 
 class Element:
@@ -161,7 +161,7 @@ class List(Element):
 	def addChild(self, child: ListItem):
 		if not hasattr(child, "set_index"):
 			if not hasattr(child, "text") or child.text != "\n":
-				print(f"ERR: element inside list is not a list item: {str(child)}")
+				getMetrics().error(f"element inside list is not a list item: {str(child)}")
 			return
 
 		if self.ordered_index is None:
@@ -177,7 +177,7 @@ class List(Element):
 		return f"{super().markdown()}\n"
 	def html(self):
 		if self.ordered_index is None:
-			return f"<ul>{super().markdown()}</ul>"
+			return f"<ul>{super().html()}</ul>"
 		else:
 			return f"<ol start=\"{self.ordered_index}\">{super().html()}</ol>"
 	def pandoc(self):
@@ -197,9 +197,15 @@ class Aside(Element):
 	def get_style(self):
 		specific_style = Aside.specific_styles.get(self.attribute, "")
 		if specific_style == "":
-			print(f"ERR: unkwnown style attribute for <aside> element: {self.attribute}")
+			getMetrics().error(f"unkwnown style attribute for <aside> element: {self.attribute}")
 		return Aside.base_style + specific_style
 
+	@classmethod
+	def stylesheet(cls):
+		return (f"aside {{ {cls.base_style}}}\n"
+			+ "".join([f"aside.{attribute} {{ {style} }}\n"
+				for attribute, style in cls.specific_styles.items()]))
+
 	def __init__(self, attribute: str):
 		super().__init__()
 		self.attribute = attribute
@@ -211,7 +217,9 @@ class Aside(Element):
 		re.sub(r"^[\s\>]+", "\n> ", content)
 		return content + "\n\n"
 	def html(self):
-		return f"<aside style=\"{self.get_style()}\">{super().html()}</aside>"
+		if self.attribute not in Aside.specific_styles:
+			getMetrics().error(f"unkwnown style attribute for <aside> element: {self.attribute}")
+		return f"<aside class=\"{self.attribute}\">{super().html()}</aside>"
 	def pandoc(self):
 		return f"<aside style=\"{self.get_style()}\">{super().pandoc()}</aside>\n"
 
@@ -273,7 +281,7 @@ class Image(Element):
 	def html(self):
 		return self.markdown()
 	def pandoc(self):
-		return self.markdown() # TODO download images and replace urls
+		return self.markdown()
 
 class Monospace(Element):
 	def __repr__(self):
@@ -286,18 +294,18 @@ class Monospace(Element):
 		return f"<code>{super().pandoc()}</code>"
 
 class Code(Element):
-	def __init__(self, htmlText: Html, default_code_language: str):
+	def __init__(self, code: str, htmlText: str, default_code_language: str):
+		self.code = code
 		self.htmlText = htmlText
 		self.default_code_language = default_code_language
 
 	def __repr__(self):
-		return f"{{Code, \"{self.htmlText.text}\"}}"
+		return f"{{Code, \"{self.code}\"}}"
 	def markdown(self):
-		code = self.htmlText.text
-		language = detectLanguage(code, self.default_code_language)
-		return f"```{language}\n{code}\n```\n"
+		language = detectLanguage(self.code, self.default_code_language)
+		return f"```{language}\n{self.code}\n```\n"
 	def html(self):
-		return str(self.htmlText)
+		return self.htmlText
 	def pandoc(self):
 		return self.markdown()
 
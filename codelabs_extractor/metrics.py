@@ -0,0 +1,231 @@
+import sys
+import threading
+import time
+
+PROMETHEUS_PREFIX = "codelabs_"
+TEXT_PREFIXES = {"warning": "WARN: ", "error": "ERR: ", "pandoc_command": "Convert to an ebook using this pandoc command: "}
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# label values (e.g. html tag names) may contain anything, see the Prometheus text format
+def escapeLabelValue(value: str):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def formatLabels(labels: tuple, extra: str = ""):
+	parts = [f"{name}=\"{escapeLabelValue(value)}\"" for name, value in labels] + ([extra] if extra else [])
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+	def __init__(self, buckets: list):
+		self.buckets = buckets
+		self.bucket_counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value: float):
+		for i in range(len(self.buckets)):
+			if value <= self.buckets[i]:
+				self.bucket_counts[i] += 1
+				break
+		self.count += 1
+		self.sum += value
+
+	def cumulative_buckets(self):
+		result, total = [], 0
+		for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+			total += bucket_count
+			result.append((bucket, total))
+		return result + [("+Inf", self.count)]
+
+class Timer:
+	def __init__(self, metrics, name: str, labels: dict):
+		self.metrics = metrics
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class NullTimer:
+	def __enter__(self):
+		return self
+	def __exit__(self, *exc_info):
+		pass
+
+NULL_TIMER = NullTimer()
+
+class Run:
+	"""Scope of a single extraction (a cli invocation or a server job) in the current thread:
+	identical warnings and errors are only reported once per run, and are also passed to
+	the optional callback, e.g. to send them to the client of a server job"""
+
+	def __init__(self, metrics, callback):
+		self.metrics = metrics
+		self.callback = callback
+		self.reported_messages = set()
+
+	def __enter__(self):
+		self.previous = getattr(self.metrics.local, "run", None)
+		self.metrics.local.run = self
+		return self
+
+	def __exit__(self, *exc_info):
+		self.metrics.local.run = self.previous
+
+
+class Metrics:
+	"""Collects counters and histograms, and reports progress, warnings and errors either as
+	text or as json lines. Inside a run, identical warnings and errors are only reported
+	once, but are all counted."""
+
+	def __init__(self, log_format: str = "text", stream = sys.stdout):
+		self.log_format = log_format # "text", "json" or None to not report anything
+		self.stream = stream
+		self.lock = threading.Lock()
+		self.counters = {} # (name, labels) -> value
+		self.histograms = {} # (name, labels) -> Histogram
+		self.gauges = {} # (name, labels) -> value
+		self.local = threading.local()
+
+	def count(self, name: str, value: int = 1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name: str, value: float, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram(SECONDS_BUCKETS)
+			self.histograms[key].observe(value)
+
+	def gauge(self, name: str, value: float, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.gauges[key] = value
+
+	def timer(self, name: str, **labels):
+		return Timer(self, name, labels)
+
+	def cache(self, cache: str, hit: bool):
+		self.count("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+	def event(self, event: str, **fields):
+		if self.log_format == "json":
+			import json
+			line = json.dumps({"event": event, "time": time.time(), **fields})
+		elif self.log_format == "text":
+			line = TEXT_PREFIXES.get(event, "") + " ".join([str(value) for value in fields.values()])
+		else:
+			return
+		with self.lock:
+			print(line, file=self.stream, flush=True)
+
+	def progress(self, stage: str, detail: str):
+		self.event("progress", stage=stage, detail=detail)
+
+	def run(self, callback = None) -> Run:
+		return Run(self, callback)
+
+	def warning(self, message: str):
+		self.count("warnings_total")
+		self.report("warning", message)
+
+	def error(self, message: str):
+		self.count("errors_total")
+		self.report("error", message)
+
+	def report(self, event: str, message: str):
+		run = getattr(self.local, "run", None)
+		if run is not None:
+			if message in run.reported_messages:
+				return
+			run.reported_messages.add(message)
+			if run.callback is not None:
+				run.callback(event, message)
+		self.event(event, message=message)
+
+
+	def cache_hit_ratios(self):
+		requests = {}
+		for (name, labels), value in self.counters.items():
+			if name == "cache_requests_total":
+				labels = dict(labels)
+				hits, total = requests.get(labels["cache"], (0, 0))
+				requests[labels["cache"]] = (hits + (value if labels["result"] == "hit" else 0), total + value)
+		return {cache: hits / total for cache, (hits, total) in requests.items() if total > 0}
+
+	def json_lines(self) -> str:
+		import json
+		with self.lock:
+			lines = [{"metric": name, "type": "counter", "labels": dict(labels), "value": value}
+				for (name, labels), value in sorted(self.counters.items())]
+			lines += [{"metric": name, "type": "histogram", "labels": dict(labels), "count": histogram.count,
+					"sum": histogram.sum, "buckets": {str(bucket): count for bucket, count in histogram.cumulative_buckets()}}
+				for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])]
+			lines += [{"metric": name, "type": "gauge", "labels": dict(labels), "value": value}
+				for (name, labels), value in sorted(self.gauges.items())]
+			lines += [{"metric": "cache_hit_ratio", "type": "gauge", "labels": {"cache": cache}, "value": ratio}
+				for cache, ratio in sorted(self.cache_hit_ratios().items())]
+		return "".join([json.dumps(line) + "\n" for line in lines])
+
+	def prometheus(self) -> str:
+		with self.lock:
+			result, declared = [], set()
+			def declare(name: str, type: str):
+				if name not in declared:
+					declared.add(name)
+					result.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {type}")
+
+			for (name, labels), value in sorted(self.counters.items()):
+				declare(name, "counter")
+				result.append(f"{PROMETHEUS_PREFIX}{name}{formatLabels(labels)} {value}")
+			for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+				declare(name, "histogram")
+				for bucket, count in histogram.cumulative_buckets():
+					bucket_labels = formatLabels(labels, f"le=\"{bucket}\"")
+					result.append(f"{PROMETHEUS_PREFIX}{name}_bucket{bucket_labels} {count}")
+				result.append(f"{PROMETHEUS_PREFIX}{name}_sum{formatLabels(labels)} {histogram.sum}")
+				result.append(f"{PROMETHEUS_PREFIX}{name}_count{formatLabels(labels)} {histogram.count}")
+			for (name, labels), value in sorted(self.gauges.items()):
+				declare(name, "gauge")
+				result.append(f"{PROMETHEUS_PREFIX}{name}{formatLabels(labels)} {value}")
+			for cache, ratio in sorted(self.cache_hit_ratios().items()):
+				declare("cache_hit_ratio", "gauge")
+				result.append(f"{PROMETHEUS_PREFIX}cache_hit_ratio{formatLabels((('cache', cache),))} {ratio}")
+		return "".join([line + "\n" for line in result])
+
+class NullMetrics(Metrics):
+	"""Ignores everything, used in quiet mode"""
+
+	def __init__(self):
+		super().__init__(None)
+	def count(self, name: str, value: int = 1, **labels):
+		pass
+	def observe(self, name: str, value: float, **labels):
+		pass
+	def gauge(self, name: str, value: float, **labels):
+		pass
+	def timer(self, name: str, **labels):
+		return NULL_TIMER
+	def event(self, event: str, **fields):
+		pass
+	def warning(self, message: str):
+		pass
+	def error(self, message: str):
+		pass
+
+
+current_metrics = Metrics()
+
+def getMetrics() -> Metrics:
+	return current_metrics
+
+def setMetrics(metrics: Metrics):
+	global current_metrics
+	current_metrics = metrics
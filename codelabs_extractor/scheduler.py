@@ -0,0 +1,220 @@
+from .metrics import getMetrics
+from concurrent.futures import Future
+import bisect
+import itertools
+import threading
+import time
+
+# lower values are fetched first; pages are on the critical path since
+# the next page's url is only known once the current page is downloaded
+PRIORITY_PAGE = 0
+PRIORITY_IMAGE = 1
+
+THROTTLING_STATUSES = [429, 503]
+# a response is considered slow if its headers take more than LATENCY_TOLERANCE times the
+# fastest response from the same host, and more than MIN_SLOW_LATENCY seconds; the body
+# transfer is not included, otherwise large images would always look slow compared to pages
+LATENCY_TOLERANCE = 2.0
+MIN_SLOW_LATENCY = 0.25
+RETRY_BACKOFF = 1.0 # seconds, doubled at every retry, used if there is no Retry-After header
+REQUEST_TIMEOUT = 60 # seconds
+
+class FetchRequest:
+	def __init__(self, url: str, host: str, priority: int, sequence: int):
+		self.url = url
+		self.host = host
+		self.priority = priority
+		self.sequence = sequence
+		self.attempts = 0
+		self.future = Future()
+
+	def __lt__(self, other):
+		return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class HostLimiter:
+	"""Limits the in-flight requests to a host, with additive increase when responses are
+	fast and multiplicative decrease when they are slow or the host is throttling us"""
+
+	def __init__(self, host: str, initial_limit: int, max_limit: int):
+		self.host = host
+		self.limit = float(min(initial_limit, max_limit))
+		self.max_limit = max_limit
+		self.in_flight = 0
+		self.pages_in_flight = 0
+		self.min_latency = None
+		self.last_decrease = 0.0
+		self.blocked_until = 0.0
+
+	def can_start(self, priority: int, now: float):
+		if now < self.blocked_until:
+			return False
+		if self.in_flight < int(self.limit):
+			return True
+		# a page may go over the limit by one when only images are in flight, so that the chain
+		# of pages never waits for an image download; max_limit is never exceeded, though
+		return priority == PRIORITY_PAGE and self.pages_in_flight == 0 and self.in_flight < self.max_limit
+
+	def start(self, priority: int):
+		self.in_flight += 1
+		if priority == PRIORITY_PAGE:
+			self.pages_in_flight += 1
+
+	def stop(self, priority: int):
+		self.in_flight -= 1
+		if priority == PRIORITY_PAGE:
+			self.pages_in_flight -= 1
+
+	def on_success(self, started: float, latency: float):
+		if self.min_latency is None or latency < self.min_latency:
+			self.min_latency = latency
+
+		if latency > max(self.min_latency * LATENCY_TOLERANCE, MIN_SLOW_LATENCY):
+			self.decrease(started, "latency")
+		elif self.in_flight + 1 >= int(self.limit) and self.limit < self.max_limit:
+			# only grow if the current limit is actually being used, by one every limit responses
+			self.set_limit(min(self.max_limit, self.limit + 1 / self.limit), "increase", "fast")
+
+	def on_throttled(self, started: float, retry_after: float):
+		self.decrease(started, "throttled")
+		self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+	def decrease(self, started: float, reason: str):
+		# responses to requests started before the last decrease were already accounted for
+		if started < self.last_decrease:
+			return
+		self.last_decrease = time.monotonic()
+		self.set_limit(max(1.0, self.limit / 2), "decrease", reason)
+
+	def set_limit(self, limit: float, direction: str, reason: str):
+		if int(limit) != int(self.limit):
+			getMetrics().count("scheduler_limit_changes_total", host=self.host, direction=direction, reason=reason)
+		self.limit = limit
+		getMetrics().gauge("scheduler_limit", int(self.limit), host=self.host)
+
+
+class FetchScheduler:
+	"""Downloads urls on a pool of threads, highest priority first, adapting the number of
+	in-flight requests to each host based on the observed latency and throttling responses"""
+
+	def __init__(self, workers: int = 32, initial_limit: int = 2, max_limit: int = 16, max_retries: int = 5):
+		self.workers = workers
+		self.initial_limit = initial_limit
+		self.max_limit = max_limit
+		self.max_retries = max_retries
+		self.condition = threading.Condition()
+		self.queue = [] # kept sorted by priority
+		self.hosts = {} # host -> HostLimiter
+		self.sequence = itertools.count()
+		self.threads = []
+
+	def submit(self, url: str, priority: int) -> Future:
+		from urllib.parse import urlparse
+		request = FetchRequest(url, urlparse(url).netloc, priority, next(self.sequence))
+		with self.condition:
+			if not self.threads:
+				self.start_workers()
+			if request.host not in self.hosts:
+				self.hosts[request.host] = HostLimiter(request.host, self.initial_limit, self.max_limit)
+			bisect.insort(self.queue, request)
+			self.condition.notify()
+		return request.future
+
+	def fetch(self, url: str, priority: int) -> bytes:
+		return self.submit(url, priority).result()
+
+	def start_workers(self):
+		for _ in range(self.workers):
+			thread = threading.Thread(target=self.worker, daemon=True)
+			thread.start()
+			self.threads.append(thread)
+
+
+	def next_request(self) -> FetchRequest:
+		# called with the condition held, waits until a request can be started
+		while True:
+			now = time.monotonic()
+			wake_up = None
+			for i in range(len(self.queue)):
+				request = self.queue[i]
+				limiter = self.hosts[request.host]
+				if limiter.can_start(request.priority, now):
+					limiter.start(request.priority)
+					return self.queue.pop(i)
+				if limiter.blocked_until > now:
+					wake_up = limiter.blocked_until if wake_up is None else min(wake_up, limiter.blocked_until)
+			self.condition.wait(None if wake_up is None else wake_up - now)
+
+	def worker(self):
+		from urllib.error import HTTPError
+		from urllib.request import urlopen
+
+		while True:
+			with self.condition:
+				request = self.next_request()
+			request.attempts += 1
+
+			started = time.monotonic()
+			try:
+				with urlopen(request.url, timeout=REQUEST_TIMEOUT) as response:
+					latency = time.monotonic() - started # urlopen returns once the headers are received
+					data = response.read()
+			except HTTPError as e:
+				getMetrics().count("fetch_responses_total", host=request.host, status=str(e.code))
+				if e.code in THROTTLING_STATUSES and request.attempts <= self.max_retries:
+					self.retry(request, started, self.retry_after(e, request.attempts))
+				else:
+					self.finish(request, started, None, e)
+			except Exception as e:
+				self.finish(request, started, None, e)
+			else:
+				metrics = getMetrics()
+				metrics.count("fetch_responses_total", host=request.host, status="200")
+				priority = "page" if request.priority == PRIORITY_PAGE else "image"
+				metrics.observe("fetch_seconds", time.monotonic() - started, priority=priority)
+				self.finish(request, started, latency, None, data)
+
+	def retry(self, request: FetchRequest, started: float, retry_after: float):
+		getMetrics().count("fetch_retries_total", host=request.host)
+		with self.condition:
+			limiter = self.hosts[request.host]
+			limiter.stop(request.priority)
+			limiter.on_throttled(started, retry_after)
+			# the original sequence number is kept, so the request does not lose its place
+			bisect.insort(self.queue, request)
+			self.condition.notify_all()
+
+	def finish(self, request: FetchRequest, started: float, latency: float, error: Exception, data: bytes = None):
+		with self.condition:
+			limiter = self.hosts[request.host]
+			limiter.stop(request.priority)
+			if latency is not None:
+				limiter.on_success(started, latency)
+			self.condition.notify_all()
+
+		if error is None:
+			request.future.set_result(data)
+		else:
+			request.future.set_exception(error)
+
+	def retry_after(self, error, attempts: int) -> float:
+		try:
+			return float(error.headers.get("Retry-After"))
+		except (TypeError, ValueError):
+			return RETRY_BACKOFF * 2 ** (attempts - 1)
+
+
+current_scheduler = None
+current_scheduler_lock = threading.Lock()
+
+def getScheduler() -> FetchScheduler:
+	global current_scheduler
+	with current_scheduler_lock:
+		# created lazily, so that no threads are started unless something is downloaded
+		if current_scheduler is None:
+			current_scheduler = FetchScheduler()
+		return current_scheduler
+
+def setScheduler(scheduler: FetchScheduler):
+	global current_scheduler
+	current_scheduler = scheduler
@@ -0,0 +1,326 @@
+from .course_extractor import CourseExtractor, FORMATS
+from .metrics import Metrics, getMetrics, setMetrics
+from .scheduler import FetchScheduler, setScheduler
+from .utils import LRUCache
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import uuid
+import zipfile
+
+HOST = "127.0.0.1"
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+	405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+def zipDirectory(directory: str) -> bytes:
+	data = io.BytesIO()
+	with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as bundle:
+		for root, _, filenames in os.walk(directory):
+			for filename in filenames:
+				file_path = os.path.join(root, filename)
+				bundle.write(file_path, os.path.relpath(file_path, directory))
+	return data.getvalue()
+
+
+class Job:
+	def __init__(self, key: tuple, course: str, formats: list, language: str, count: int, download_images: bool):
+		self.id = uuid.uuid4().hex
+		self.key = key
+		self.course = course
+		self.formats = formats
+		self.language = language
+		self.count = count
+		self.download_images = download_images
+
+		self.status = "queued"
+		self.error = None
+		self.bundle = None
+		self.events = []
+		self.new_event = asyncio.Event()
+
+	def finished(self):
+		return self.status in ["done", "failed"]
+
+	def add_event(self, event: dict):
+		self.events.append(event)
+		# wake up whoever is streaming events, and prepare for the next ones
+		self.new_event.set()
+		self.new_event = asyncio.Event()
+
+	def set_status(self, status: str):
+		self.status = status
+		self.add_event({"status": status} if self.error is None else {"status": status, "error": self.error})
+
+	def info(self):
+		return {"id": self.id, "status": self.status, "error": self.error, "course": self.course,
+			"formats": self.formats, "language": self.language, "count": self.count, "download_images": self.download_images}
+
+
+class ExtractionServer:
+	"""Runs extraction jobs on a worker pool, keeping downloaded pages, images and extracted
+	courses in memory between jobs. Identical concurrent jobs, and concurrent extractions of the same
+	course, are coalesced."""
+
+	def __init__(self, workers: int, page_cache_size: int, image_cache_size: int, course_cache_size: int, job_history_size: int):
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.page_cache = LRUCache(page_cache_size)
+		# shared by courses extracted with different arguments (e.g. count or language)
+		self.image_cache = LRUCache(image_cache_size)
+		self.course_cache = LRUCache(course_cache_size)
+		self.job_history_size = job_history_size
+		self.jobs = OrderedDict() # job id -> Job, only accessed from the event loop thread
+		self.active_jobs = {} # job key -> Job
+		self.extractions = {} # course key -> Future of CourseExtractor
+		self.extractions_lock = threading.Lock()
+
+	def submit(self, course: str, formats: list, language: str, count: int, download_images: bool):
+		key = (course, tuple(sorted(formats)), language, count, download_images)
+		if key in self.active_jobs:
+			return self.active_jobs[key], True
+
+		job = Job(key, course, formats, language, count, download_images)
+		self.jobs[job.id] = job
+		self.active_jobs[key] = job
+		self.forget_old_jobs()
+		asyncio.get_running_loop().create_task(self.run(job))
+		return job, False
+
+	async def run(self, job: Job):
+		loop = asyncio.get_running_loop()
+		def started():
+			loop.call_soon_threadsafe(job.set_status, "running")
+		def emit(event: dict):
+			loop.call_soon_threadsafe(job.add_event, event)
+
+		try:
+			job.bundle = await loop.run_in_executor(self.executor, self.run_job, job, started, emit)
+			job.set_status("done")
+		except Exception as e:
+			job.error = f"{type(e).__name__}: {e}"
+			job.set_status("failed")
+		finally:
+			del self.active_jobs[job.key]
+			self.forget_old_jobs()
+
+	def forget_old_jobs(self):
+		# drop the oldest finished jobs (and their bundles), but never running ones,
+		# otherwise their status and events would not be reachable anymore
+		excess = len(self.jobs) - self.job_history_size
+		for id in [id for id, job in self.jobs.items() if job.finished()][:max(0, excess)]:
+			del self.jobs[id]
+
+	def run_job(self, job: Job, started, emit) -> bytes:
+		started()
+		# warnings and errors are deduplicated per job and sent to its events, e.g. {"error": "..."}
+		with getMetrics().run(lambda event, message: emit({event: message})):
+			course = self.get_course(job, emit)
+
+			with tempfile.TemporaryDirectory() as directory:
+				for format in job.formats:
+					emit({"stage": "Exporting", "detail": format})
+					course.export(format, os.path.join(directory, format))
+				return zipDirectory(directory)
+
+	def get_course(self, job: Job, emit) -> CourseExtractor:
+		course_key = (job.course, job.language, job.count, job.download_images)
+		course = self.course_cache.get(course_key)
+		getMetrics().cache("courses", course is not None)
+		if course is not None:
+			emit({"stage": "Cached", "detail": job.course})
+			return course
+
+		with self.extractions_lock:
+			extraction = self.extractions.get(course_key)
+			owner = extraction is None
+			if owner:
+				extraction = Future()
+				self.extractions[course_key] = extraction
+
+		if not owner:
+			emit({"stage": "Waiting", "detail": job.course})
+			return extraction.result()
+
+		try:
+			course = CourseExtractor(job.course, job.language, job.count, None, self.page_cache,
+				lambda stage, detail: emit({"stage": stage, "detail": detail}), job.download_images, self.image_cache)
+			self.course_cache.put(course_key, course)
+			extraction.set_result(course)
+			return course
+		except Exception as e:
+			extraction.set_exception(e)
+			raise
+		finally:
+			with self.extractions_lock:
+				del self.extractions[course_key]
+
+
+	async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+			headers = {}
+			while True:
+				line = await reader.readline()
+				if line in [b"\r\n", b"\n", b""]:
+					break
+				name, _, value = line.decode("latin-1").partition(":")
+				headers[name.strip().lower()] = value.strip()
+			body = await reader.readexactly(int(headers.get("content-length", 0)))
+		except (ValueError, asyncio.IncompleteReadError):
+			self.respond_json(writer, 400, {"error": "malformed request"})
+		else:
+			try:
+				target = urlsplit(target)
+				await self.route(method, target.path.strip("/").split("/"), parse_qs(target.query), body, writer)
+			except ConnectionError:
+				pass
+		finally:
+			writer.close()
+
+	async def route(self, method: str, path: list, query: dict, body: bytes, writer: asyncio.StreamWriter):
+		if path == ["metrics"]:
+			if query.get("format") == ["json"]:
+				return self.respond(writer, 200, "application/x-ndjson", getMetrics().json_lines().encode("utf-8"))
+			return self.respond(writer, 200, "text/plain; version=0.0.4", getMetrics().prometheus().encode("utf-8"))
+
+		if path == ["jobs"]:
+			if method != "POST":
+				return self.respond_json(writer, 405, {"error": "use POST to create jobs"})
+			return self.create_job(body, writer)
+
+		if len(path) < 2 or len(path) > 3 or path[0] != "jobs":
+			return self.respond_json(writer, 404, {"error": "not found"})
+		if method != "GET":
+			return self.respond_json(writer, 405, {"error": "use GET to query jobs"})
+		job = self.jobs.get(path[1])
+		if job is None:
+			return self.respond_json(writer, 404, {"error": f"unknown job {path[1]}"})
+
+		if len(path) == 2:
+			self.respond_json(writer, 200, job.info())
+		elif path[2] == "events":
+			await self.stream_events(job, writer)
+		elif path[2] == "bundle":
+			if job.status == "done":
+				self.respond(writer, 200, "application/zip", job.bundle)
+			else:
+				self.respond_json(writer, 409, job.info())
+		else:
+			self.respond_json(writer, 404, {"error": "not found"})
+
+	def create_job(self, body: bytes, writer: asyncio.StreamWriter):
+		try:
+			request = json.loads(body)
+			course = request["course"]
+			formats = request.get("formats", ["html"])
+			language = request.get("language", "")
+			count = request.get("count", 999999) # infinity
+			download_images = request.get("download_images", False)
+			if (not isinstance(course, str) or not isinstance(formats, list) or not formats
+					or not isinstance(language, str) or not isinstance(count, int) or isinstance(count, bool)
+					or not isinstance(download_images, bool)):
+				raise ValueError("invalid field types")
+		except (ValueError, KeyError, TypeError) as e:
+			return self.respond_json(writer, 400, {"error": f"invalid job request: {e}"})
+
+		if count < 1:
+			return self.respond_json(writer, 400, {"error": "count must be at least 1"})
+		# anything else, e.g. file://, would be read by urlopen
+		if urlsplit(course).scheme not in ["http", "https"]:
+			return self.respond_json(writer, 400, {"error": "course must be an http or https url"})
+
+		unknown_formats = [format for format in formats if format not in FORMATS]
+		if unknown_formats:
+			return self.respond_json(writer, 400, {"error": f"unknown formats {unknown_formats}"})
+
+		job, coalesced = self.submit(course, formats, language, count, download_images)
+		self.respond_json(writer, 202, {**job.info(), "coalesced": coalesced})
+
+	async def stream_events(self, job: Job, writer: asyncio.StreamWriter):
+		# events are sent as json lines, the connection is closed when the job finishes
+		self.write_head(writer, 200, "application/x-ndjson")
+		sent = 0
+		while True:
+			new_event = job.new_event
+			for event in job.events[sent:]:
+				writer.write(json.dumps(event).encode("utf-8") + b"\n")
+			sent = len(job.events)
+			await writer.drain()
+			if job.finished():
+				break
+			await new_event.wait()
+
+	def write_head(self, writer: asyncio.StreamWriter, status: int, content_type: str, headers: dict = {}):
+		head = f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: {content_type}\r\nConnection: close\r\n"
+		for name, value in headers.items():
+			head += f"{name}: {value}\r\n"
+		writer.write((head + "\r\n").encode("latin-1"))
+
+	def respond(self, writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes):
+		self.write_head(writer, status, content_type, {"Content-Length": len(body)})
+		writer.write(body)
+
+	def respond_json(self, writer: asyncio.StreamWriter, status: int, data: dict):
+		self.respond(writer, status, "application/json", json.dumps(data).encode("utf-8") + b"\n")
+
+	async def serve(self, port: int):
+		server = await asyncio.start_server(self.handle_connection, HOST, port)
+		print(f"Listening on http://{HOST}:{port}/")
+		async with server:
+			await server.serve_forever()
+
+
+def parseArgs(namespace):
+	argParser = argparse.ArgumentParser(fromfile_prefix_chars="@",
+		description="Runs a local http server that extracts Google Codelab courses on demand, keeping caches warm between requests."
+		+ " POST {\"course\": URL, \"formats\": [FMT, ...], \"language\": LANG, \"count\": N, \"download_images\": BOOL} to /jobs,"
+		+ " then GET /jobs/ID, /jobs/ID/events (json lines) and /jobs/ID/bundle (zip)."
+		+ " GET /metrics (or /metrics?format=json) returns metrics about all jobs run so far.")
+
+	argParser.add_argument("-p", "--port", type=int, default=8000, metavar="PORT",
+		help=f"The port to listen on (only on {HOST}). Defaults to 8000.")
+	argParser.add_argument("-w", "--workers", type=int, default=4, metavar="N",
+		help="The number of jobs that can run at the same time. Defaults to 4.")
+	argParser.add_argument("--max-connections", type=int, default=16, metavar="N",
+		help="The maximum number of parallel downloads from the same host, shared by all jobs. Defaults to 16.")
+	argParser.add_argument("-q", "--quiet", action="store_true",
+		help="Do not print progress, warnings and errors of jobs (they are still sent to /jobs/ID/events)")
+	argParser.add_argument("--log-format", type=str, default="text", choices=["text", "json"],
+		help="Print progress, warnings and errors of jobs as text or as json lines. Defaults to text.")
+	argParser.add_argument("--page-cache-size", type=int, default=1024, metavar="N",
+		help="The maximum number of downloaded pages to keep in memory. Defaults to 1024.")
+	argParser.add_argument("--image-cache-size", type=int, default=1024, metavar="N",
+		help="The maximum number of downloaded images to keep in memory. Defaults to 1024.")
+	argParser.add_argument("--course-cache-size", type=int, default=16, metavar="N",
+		help="The maximum number of extracted courses to keep in memory. Defaults to 16.")
+	argParser.add_argument("--job-history-size", type=int, default=64, metavar="N",
+		help="The maximum number of finished jobs (and their output bundles) to remember;"
+		+ " running jobs are never forgotten. Defaults to 64.")
+
+	argParser.parse_args(namespace=namespace)
+
+	if namespace.max_connections < 1:
+		argParser.error("--max-connections must be at least 1")
+
+def main():
+	class Args: pass
+	parseArgs(Args)
+
+	# metrics are still collected in quiet mode, since they are served at /metrics
+	setMetrics(Metrics(None if Args.quiet else Args.log_format))
+	setScheduler(FetchScheduler(max_limit=Args.max_connections))
+	server = ExtractionServer(Args.workers, Args.page_cache_size, Args.image_cache_size,
+		Args.course_cache_size, Args.job_history_size)
+	try:
+		asyncio.run(server.serve(Args.port))
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
@@ -1,30 +1,85 @@
-from bs4 import BeautifulSoup as Html
-from urllib.request import urlopen
-from urllib.parse import urlparse
+from collections import OrderedDict
+from functools import lru_cache
+from .metrics import getMetrics
+import io
 import re
 import os
+import threading
+
+# Heavy modules (bs4, urllib, hashlib, gzip, brotli, the scheduler) are imported inside the functions that
+# need them, so that e.g. `--help` or exporting an already extracted course starts quickly.
+
+class LRUCache:
+	"""Thread-safe mapping that keeps at most max_size entries, dropping the least recently used"""
+
+	def __init__(self, max_size: int):
+		self.max_size = max_size
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key):
+		with self.lock:
+			if key not in self.entries:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+def fetchUrl(url: str):
+	from .scheduler import getScheduler, PRIORITY_PAGE
+	data = getScheduler().fetch(url, PRIORITY_PAGE)
+	metrics = getMetrics()
+	metrics.count("pages_fetched_total")
+	metrics.count("fetched_bytes_total", len(data))
+	return data
+
+def downloadPage(url: str, cache_pages_directory: str, page_cache: LRUCache = None):
+	if page_cache is not None:
+		data = page_cache.get(url)
+		getMetrics().cache("memory_pages", data is not None)
+		if data is None:
+			data = downloadPage(url, cache_pages_directory)
+			page_cache.put(url, data)
+		return data
 
-def downloadPage(url: str, cache_pages_directory: str):
 	if cache_pages_directory is None:
-		return urlopen(url).read()
+		return fetchUrl(url)
 
 	filename = re.sub(r"[\<\>\:\"\/\\\|\?\*]", r"_", url) + ".html"
 	file_path = os.path.join(cache_pages_directory, filename)
 
+	getMetrics().cache("disk_pages", os.path.exists(file_path))
 	if os.path.exists(file_path):
 		with open(file_path, "rb") as f:
 			return f.read()
 	else:
-		data = urlopen(url).read()
+		data = fetchUrl(url)
 		os.makedirs(cache_pages_directory, exist_ok=True)
 		with open(file_path, "wb") as f:
 			f.write(data)
 		return data
 
-def getPageHtml(url: str, cache_pages_directory: str):
-	return Html(downloadPage(url, cache_pages_directory), features='html.parser')
+def getPageHtml(url: str, cache_pages_directory: str, page_cache: LRUCache = None):
+	from bs4 import BeautifulSoup as Html
+	data = downloadPage(url, cache_pages_directory, page_cache)
+	with getMetrics().timer("parse_seconds"):
+		return Html(data, features='html.parser')
 
 def extractHost(url: str):
+	from urllib.parse import urlparse
 	parsed = urlparse(url)
 	return '{uri.scheme}://{uri.netloc}/'.format(uri=parsed)
 
@@ -85,3 +140,48 @@ def escapeXml(string: str):
 	for ch, rep in [("&","&amp;"), ('"',"&quot;"), ("'","&apos;"), ("<","&lt;"), (">","&gt;")]:
 		string = string.replace(ch, rep)
 	return string
+
+def contentHash(data: bytes, length: int = 10):
+	import hashlib
+	return hashlib.sha256(data).hexdigest()[:length]
+
+# named after the hash of the content, so that images can be cached forever like the stylesheet
+def localImagePath(url: str, data: bytes):
+	from urllib.parse import urlparse
+	extension = os.path.splitext(urlparse(url).path)[1]
+	if not re.fullmatch(r"\.[a-zA-Z0-9]{1,5}", extension):
+		extension = ""
+	return f"images/{contentHash(data)}{extension}"
+
+def hashedFilename(filename: str, data: bytes):
+	name, extension = os.path.splitext(filename)
+	return f"{name}.{contentHash(data)}{extension}"
+
+# failed imports are not cached by python, so remember that brotli is not available
+@lru_cache(maxsize=None)
+def importBrotli():
+	try:
+		import brotli
+		return brotli
+	except ImportError:
+		return None
+
+# writes the file along with .gz and (if the brotli module is available) .br
+# siblings, so that a static web server can serve them without compressing
+def writePrecompressedFile(file_path: str, data: bytes):
+	import gzip
+	brotli = importBrotli()
+
+	with open(file_path, "wb") as f:
+		f.write(data)
+
+	gzipped = io.BytesIO()
+	# empty filename and mtime=0 so that output only depends on data
+	with gzip.GzipFile(filename="", mode="wb", compresslevel=9, fileobj=gzipped, mtime=0) as f:
+		f.write(data)
+	with open(file_path + ".gz", "wb") as f:
+		f.write(gzipped.getvalue())
+
+	if brotli is not None:
+		with open(file_path + ".br", "wb") as f:
+			f.write(brotli.compress(data, quality=11))
@@ -0,0 +1,110 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+class StandinServer:
+	"""Serves fake codelabs on localhost, in place of the codelabs website: course-01 ... course-N
+	are linked to each other through "next" buttons and contain some images (img/<codelab>_<i>.png),
+	the last missing_images of which respond with 404. Images are padded to image_size bytes, and their
+	body is streamed slowly over transfer_time seconds after the headers. Like a throttling CDN, it
+	responds with 429 and a Retry-After header to requests beyond max_concurrency in-flight ones."""
+
+	def __init__(self, codelabs: int = 2, images: int = 2, delay: float = 0.0, missing_images: int = 0,
+			max_concurrency: int = None, retry_after: float = 0.1, image_size: int = 0, transfer_time: float = 0.0):
+		self.codelabs = codelabs
+		self.images = images
+		self.missing_images = missing_images
+		self.delay = delay # seconds to wait before answering each request
+		self.max_concurrency = max_concurrency
+		self.retry_after = retry_after
+		self.image_size = image_size
+		self.transfer_time = transfer_time
+		self.lock = threading.Lock()
+		self.served = [] # paths of the successful responses, in order
+		self.in_flight = 0
+		self.peak_in_flight = 0
+		self.throttled = 0
+
+		server = self
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				server.handle(self)
+			def log_message(self, *args):
+				pass
+		self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.httpd.daemon_threads = True
+
+	def __enter__(self):
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.httpd.shutdown()
+		self.httpd.server_close()
+
+	def url(self, path: str) -> str:
+		return f"http://127.0.0.1:{self.httpd.server_address[1]}/{path}"
+
+	def codelab_url(self, index: int) -> str:
+		return self.url(f"course-{index:02}/index.html")
+
+	def page(self, index: int) -> bytes:
+		images = "".join([f"<img src=\"img/{index}_{i}.png\" alt=\"image {i}\">" for i in range(self.images)])
+		next_step = ""
+		if index < self.codelabs:
+			next_step = (f"<google-codelab-step label=\"Next\"><p><a href=\"{self.codelab_url(index + 1)}\">"
+				+ "<paper-button>Next codelab</paper-button></a></p></google-codelab-step>")
+		return (f"<html><body><google-codelab id=\"course-{index:02}\" title=\"Lesson 01.{index}: Part {index}\">"
+			+ f"<google-codelab-step label=\"Step\"><p>Text of <b>part {index}</b></p>"
+			+ f"<p class=\"image-container\">{images}</p><pre>fun main() {{ println(\"{index}\") }}</pre>"
+			+ f"</google-codelab-step>{next_step}</google-codelab></body></html>").encode("utf-8")
+
+	def respond(self, handler: BaseHTTPRequestHandler, status: int, body: bytes = b"", headers: dict = {},
+			transfer_time: float = 0.0):
+		handler.send_response(status)
+		for name, value in headers.items():
+			handler.send_header(name, value)
+		handler.send_header("Content-Length", str(len(body)))
+		handler.end_headers()
+
+		chunks = 10 if transfer_time > 0 else 1
+		chunk_size = len(body) // chunks + 1
+		for i in range(chunks):
+			time.sleep(transfer_time / chunks)
+			handler.wfile.write(body[i * chunk_size:(i + 1) * chunk_size])
+
+	def handle(self, handler: BaseHTTPRequestHandler):
+		with self.lock:
+			throttle = self.max_concurrency is not None and self.in_flight >= self.max_concurrency
+			if throttle:
+				self.throttled += 1
+			else:
+				self.in_flight += 1
+				self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+		if throttle:
+			return self.respond(handler, 429, headers={"Retry-After": str(self.retry_after)})
+
+		try:
+			self.serve(handler)
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+	def serve(self, handler: BaseHTTPRequestHandler):
+		time.sleep(self.delay)
+		path = handler.path.lstrip("/")
+		if "/img/" in path:
+			if int(path.split("_")[-1].split(".")[0]) >= self.images - self.missing_images:
+				return self.respond(handler, 404)
+			body = b"\x89PNG fake image " + path.encode("utf-8")
+			body += b"\0" * (self.image_size - len(body))
+			transfer_time = self.transfer_time
+		elif path.startswith("course-") and int(path[7:9]) <= self.codelabs:
+			body = self.page(int(path[7:9]))
+			transfer_time = 0.0
+		else:
+			return self.respond(handler, 404)
+
+		with self.lock:
+			self.served.append(path)
+		self.respond(handler, 200, body, transfer_time=transfer_time)
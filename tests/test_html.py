@@ -0,0 +1,59 @@
+from standin_server import StandinServer
+from codelabs_extractor.metrics import Metrics, getMetrics, setMetrics
+from codelabs_extractor.utils import contentHash, importBrotli
+import gzip
+import io
+import os
+import re
+import pytest
+
+pytest.importorskip("bs4")
+from codelabs_extractor.course_extractor import CourseExtractor
+
+@pytest.fixture
+def site(tmp_path):
+	with StandinServer(codelabs=3) as server:
+		course = CourseExtractor(server.codelab_url(1), "kotlin", 999999, None)
+
+	previous = getMetrics()
+	stream = io.StringIO()
+	setMetrics(Metrics("text", stream))
+	try:
+		with getMetrics().run():
+			course.export("html", str(tmp_path))
+	finally:
+		setMetrics(previous)
+	return tmp_path, stream.getvalue()
+
+def test_files_are_precompressed(site):
+	directory, _ = site
+	files = [filename for filename in os.listdir(directory) if not filename.endswith((".gz", ".br"))]
+	assert len(files) == 5 # 3 pages, index and stylesheet
+	for filename in files:
+		with open(directory / filename, "rb") as f, gzip.open(directory / (filename + ".gz"), "rb") as gzipped:
+			assert gzipped.read() == f.read()
+
+def test_stylesheet_is_named_after_its_hash(site):
+	directory, _ = site
+	stylesheets = [filename for filename in os.listdir(directory) if filename.endswith(".css")]
+	assert len(stylesheets) == 1
+	with open(directory / stylesheets[0], "rb") as f:
+		assert stylesheets[0] == f"style.{contentHash(f.read())}.css"
+	for page in ["index.html", "0.html", "2.html"]:
+		assert f"<link rel=\"stylesheet\" href=\"./{stylesheets[0]}\">" in (directory / page).read_text()
+
+def test_index_links_to_every_chapter(site):
+	directory, _ = site
+	links = re.findall(r"<li><a href=\"\./([^\"]*)\">", (directory / "index.html").read_text())
+	assert links == ["0.html", "1.html", "2.html"]
+	assert all([os.path.exists(directory / link) for link in links])
+
+def test_missing_brotli_is_reported_once(site):
+	directory, output = site
+	warnings = [line for line in output.splitlines() if line.startswith("WARN: ") and "brotli" in line]
+	if importBrotli() is None:
+		assert len(warnings) == 1
+		assert not any([filename.endswith(".br") for filename in os.listdir(directory)])
+	else:
+		assert warnings == []
+		assert len([filename for filename in os.listdir(directory) if filename.endswith(".br")]) == 5
@@ -0,0 +1,34 @@
+from standin_server import StandinServer
+import os
+import re
+import pytest
+
+pytest.importorskip("bs4")
+from codelabs_extractor.course_extractor import CourseExtractor
+from codelabs_extractor.utils import contentHash
+
+def imageSources(file_path):
+	with open(file_path) as f:
+		return re.findall(r"<img src=\"([^\"]*)\"", f.read())
+
+def test_downloaded_images_are_linked_locally(tmp_path):
+	with StandinServer(codelabs=2, images=3) as server:
+		course = CourseExtractor(server.codelab_url(1), "", 999999, None, download_images=True)
+	course.export("html", str(tmp_path))
+
+	sources = imageSources(tmp_path / "0.html")
+	assert len(sources) == 3
+	for source in sources:
+		assert source.startswith("images/")
+		with open(tmp_path / source, "rb") as f:
+			assert contentHash(f.read()) in source
+
+def test_failed_images_are_linked_online(tmp_path):
+	with StandinServer(codelabs=2, images=3, missing_images=1) as server:
+		course = CourseExtractor(server.codelab_url(1), "", 999999, None, download_images=True)
+		course.export("html", str(tmp_path))
+
+		sources = imageSources(tmp_path / "0.html")
+		assert all([source.startswith("images/") for source in sources[:2]])
+		assert sources[2] == server.url("course-01/img/1_2.png")
+	assert len(os.listdir(tmp_path / "images")) == 4
@@ -0,0 +1,59 @@
+from standin_server import StandinServer
+from codelabs_extractor.metrics import Metrics, NullMetrics, getMetrics, setMetrics
+import io
+import pytest
+
+def test_messages_are_deduplicated_per_run():
+	stream = io.StringIO()
+	metrics = Metrics("text", stream)
+	reported = []
+
+	with metrics.run(lambda event, message: reported.append((event, message))):
+		metrics.error("unknown html element: foo")
+		metrics.error("unknown html element: foo")
+		metrics.warning("could not extract chapter")
+	with metrics.run():
+		metrics.error("unknown html element: foo")
+
+	assert reported == [("error", "unknown html element: foo"), ("warning", "could not extract chapter")]
+	assert stream.getvalue().splitlines() == ["ERR: unknown html element: foo",
+		"WARN: could not extract chapter", "ERR: unknown html element: foo"]
+	assert metrics.counters[("errors_total", ())] == 3
+
+def test_prometheus_output():
+	metrics = Metrics(None)
+	metrics.count("unknown_tags_total", 2, tag="foo")
+	metrics.observe("fetch_seconds", 0.02)
+	metrics.cache("courses", True)
+	metrics.cache("courses", False)
+
+	lines = metrics.prometheus().splitlines()
+	assert "codelabs_unknown_tags_total{tag=\"foo\"} 2" in lines
+	assert "codelabs_fetch_seconds_bucket{le=\"0.05\"} 1" in lines
+	assert "codelabs_fetch_seconds_count 1" in lines
+	assert "codelabs_cache_hit_ratio{cache=\"courses\"} 0.5" in lines
+
+def test_pandoc_command_is_reported(tmp_path, capsys):
+	pytest.importorskip("bs4")
+	from codelabs_extractor.course_extractor import CourseExtractor
+	with StandinServer(codelabs=2) as server:
+		course = CourseExtractor(server.codelab_url(1), "", 999999, None)
+
+	previous = getMetrics()
+	try:
+		stream = io.StringIO()
+		setMetrics(Metrics("text", stream))
+		course.export("pandoc", str(tmp_path))
+		assert stream.getvalue() == ("Convert to an ebook using this pandoc command: pandoc --verbose -o OUTPUT_FILE "
+			+ " ".join([str(tmp_path / filename) for filename in ["title.txt", "0.md", "1.md"]]) + "\n")
+
+		setMetrics(NullMetrics())
+		course.export("pandoc", str(tmp_path))
+	finally:
+		setMetrics(previous)
+	assert capsys.readouterr().out == ""
+
+def test_prometheus_label_values_are_escaped():
+	metrics = Metrics(None)
+	metrics.count("unknown_tags_total", tag="a\"b\\c\nd")
+	assert "codelabs_unknown_tags_total{tag=\"a\\\"b\\\\c\\nd\"} 1" in metrics.prometheus().splitlines()
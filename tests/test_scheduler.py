@@ -0,0 +1,89 @@
+from standin_server import StandinServer
+from codelabs_extractor.metrics import Metrics, getMetrics, setMetrics
+from codelabs_extractor.scheduler import FetchScheduler, PRIORITY_PAGE, PRIORITY_IMAGE
+import pytest
+import time
+
+@pytest.fixture
+def metrics():
+	previous = getMetrics()
+	setMetrics(Metrics(None))
+	yield getMetrics()
+	setMetrics(previous)
+
+def imageUrls(server: StandinServer, codelab: int = 1):
+	return [server.url(f"course-{codelab:02}/img/{codelab}_{i}.png") for i in range(server.images)]
+
+def test_throttling_decreases_limit_and_retries(metrics):
+	with StandinServer(images=30, delay=0.05, max_concurrency=3, retry_after=0.1) as server:
+		host = server.url("")[len("http://"):-1]
+		scheduler = FetchScheduler(workers=16, initial_limit=8, max_limit=16)
+		downloads = [scheduler.submit(url, PRIORITY_IMAGE) for url in imageUrls(server)]
+		results = [download.result(timeout=30) for download in downloads]
+
+	assert all([result.startswith(b"\x89PNG") for result in results])
+	assert server.throttled > 0
+	assert metrics.counters[("fetch_retries_total", (("host", host),))] == server.throttled
+	assert metrics.counters[("scheduler_limit_changes_total",
+		(("direction", "decrease"), ("host", host), ("reason", "throttled")))] > 0
+	assert scheduler.hosts[host].limit < 8
+
+def test_pages_are_fetched_before_queued_images(metrics):
+	with StandinServer(images=6, delay=0.05) as server:
+		scheduler = FetchScheduler(workers=4, initial_limit=1, max_limit=1)
+		downloads = [scheduler.submit(url, PRIORITY_IMAGE) for url in imageUrls(server)]
+		page = scheduler.submit(server.codelab_url(2), PRIORITY_PAGE)
+		for download in downloads + [page]:
+			download.result(timeout=30)
+
+	# only the first image may have been started before the page was submitted
+	assert server.served.index("course-02/index.html") <= 1
+	images = [path for path in server.served if "/img/" in path]
+	assert images == sorted(images)
+
+def test_slow_transfers_of_large_images_do_not_decrease_limit(metrics):
+	# the server always answers in 10ms, but streaming the images takes much longer than the pages
+	with StandinServer(images=24, delay=0.01, image_size=400000, transfer_time=0.4) as server:
+		host = server.url("")[len("http://"):-1]
+		scheduler = FetchScheduler(workers=8, initial_limit=4, max_limit=4)
+		scheduler.fetch(server.codelab_url(1), PRIORITY_PAGE)
+		downloads = [scheduler.submit(url, PRIORITY_IMAGE) for url in imageUrls(server)]
+		results = [download.result(timeout=30) for download in downloads]
+
+	assert all([len(result) == 400000 for result in results])
+	assert scheduler.hosts[host].limit == 4
+	assert server.peak_in_flight == 4
+
+def test_initial_limit_does_not_exceed_max_limit(metrics):
+	with StandinServer(images=6, delay=0.05) as server:
+		scheduler = FetchScheduler(workers=4, max_limit=1)
+		for download in [scheduler.submit(url, PRIORITY_IMAGE) for url in imageUrls(server)]:
+			download.result(timeout=30)
+	assert server.peak_in_flight == 1
+
+@pytest.mark.parametrize("module", ["__main__", "server"])
+def test_max_connections_must_be_positive(module, monkeypatch, capsys):
+	import importlib
+	parseArgs = importlib.import_module(f"codelabs_extractor.{module}").parseArgs
+	arguments = ["-c", "http://127.0.0.1/", "-o", "out", "-f", "md"] if module == "__main__" else []
+	monkeypatch.setattr("sys.argv", ["codelabs_extractor", *arguments, "--max-connections", "0"])
+
+	class Args: pass
+	with pytest.raises(SystemExit):
+		parseArgs(Args)
+	assert "--max-connections must be at least 1" in capsys.readouterr().err
+
+def test_pages_do_not_wait_for_images_in_flight(metrics):
+	with StandinServer(images=8, delay=0.5) as server:
+		scheduler = FetchScheduler(workers=4, initial_limit=2, max_limit=3)
+		downloads = [scheduler.submit(url, PRIORITY_IMAGE) for url in imageUrls(server)]
+		time.sleep(0.1) # the first two images are now in flight and fill the limit
+		submitted = time.monotonic()
+		scheduler.fetch(server.codelab_url(2), PRIORITY_PAGE)
+		page_seconds = time.monotonic() - submitted
+		for download in downloads:
+			download.result(timeout=30)
+
+	# it would take about 0.9s if the page waited for one of the images to finish
+	assert page_seconds < 0.75
+	assert server.peak_in_flight == 3
@@ -0,0 +1,170 @@
+from standin_server import StandinServer
+from codelabs_extractor.metrics import Metrics, getMetrics, setMetrics
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import http.client
+import io
+import json
+import threading
+import zipfile
+import pytest
+
+pytest.importorskip("bs4")
+from codelabs_extractor.server import ExtractionServer, HOST
+
+class ServerThread:
+	"""Runs an ExtractionServer on a free port, with its event loop in a background thread"""
+
+	def __init__(self, job_history_size: int):
+		self.server = ExtractionServer(4, 1024, 1024, 16, job_history_size)
+		self.loop = asyncio.new_event_loop()
+		self.tcp_server = self.loop.run_until_complete(asyncio.start_server(self.server.handle_connection, HOST, 0))
+		self.port = self.tcp_server.sockets[0].getsockname()[1]
+		self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+		self.thread.start()
+
+	def close(self):
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.tcp_server.close()
+		self.server.executor.shutdown()
+
+	def request(self, method: str, path: str, body = None):
+		"""Returns the status and the body of the response; body can be bytes or json data"""
+		if body is not None and not isinstance(body, bytes):
+			body = json.dumps(body).encode("utf-8")
+		connection = http.client.HTTPConnection(HOST, self.port, timeout=30)
+		try:
+			connection.request(method, path, body)
+			response = connection.getresponse()
+			return response.status, response.read()
+		finally:
+			connection.close()
+
+	def create_job(self, **request):
+		status, body = self.request("POST", "/jobs", request)
+		assert status == 202, body
+		return json.loads(body)
+
+	def events(self, job_id: str):
+		"""Streams the events of the job until it finishes"""
+		status, body = self.request("GET", f"/jobs/{job_id}/events")
+		assert status == 200
+		return [json.loads(line) for line in body.splitlines()]
+
+@pytest.fixture
+def metrics():
+	previous = getMetrics()
+	setMetrics(Metrics(None))
+	yield getMetrics()
+	setMetrics(previous)
+
+@pytest.fixture
+def server(metrics):
+	server = ServerThread(job_history_size=16)
+	yield server
+	server.close()
+
+def pagesServed(standin: StandinServer):
+	return [path for path in standin.served if "/img/" not in path]
+
+@pytest.mark.parametrize("body", [b"not json", {"formats": ["md"]}, {"course": 42},
+	{"course": "http://127.0.0.1/", "count": True}, {"course": "http://127.0.0.1/", "count": 0},
+	{"course": "file:///etc/passwd"}, {"course": "http://127.0.0.1/", "formats": []},
+	{"course": "http://127.0.0.1/", "formats": ["pdf"]}, {"course": "http://127.0.0.1/", "download_images": "yes"}])
+def test_invalid_job_requests_are_rejected(server, body):
+	status, response = server.request("POST", "/jobs", body)
+	assert status == 400
+	assert "error" in json.loads(response)
+	assert len(server.server.jobs) == 0
+
+def test_unknown_routes(server):
+	assert server.request("GET", "/jobs")[0] == 405
+	assert server.request("GET", "/jobs/unknown")[0] == 404
+	assert server.request("POST", "/jobs/unknown")[0] == 405
+	assert server.request("GET", "/other")[0] == 404
+
+def test_job_events_and_bundle(server):
+	with StandinServer(codelabs=3, delay=0.1) as standin:
+		job = server.create_job(course=standin.codelab_url(1), formats=["md", "html"])
+		assert not job["coalesced"]
+
+		status, body = server.request("GET", f"/jobs/{job['id']}/bundle")
+		assert status == 409
+		assert json.loads(body)["status"] in ["queued", "running"]
+
+		events = server.events(job["id"])
+
+	assert events[0] == {"status": "running"}
+	assert events[-1] == {"status": "done"}
+	assert [event["detail"] for event in events if event.get("stage") == "Downloading"] == \
+		[standin.codelab_url(i) for i in range(1, 4)]
+	assert {"stage": "Exporting", "detail": "html"} in events
+
+	status, body = server.request("GET", f"/jobs/{job['id']}")
+	assert status == 200 and json.loads(body)["status"] == "done"
+	status, body = server.request("GET", f"/jobs/{job['id']}/bundle")
+	assert status == 200
+	names = zipfile.ZipFile(io.BytesIO(body)).namelist()
+	assert {"md/0.md", "md/2.md", "html/index.html", "html/2.html.gz"} <= set(names)
+
+def test_identical_jobs_are_coalesced(server):
+	with StandinServer(codelabs=3, delay=0.1) as standin:
+		first = server.create_job(course=standin.codelab_url(1), formats=["md"])
+		second = server.create_job(course=standin.codelab_url(1), formats=["md"])
+		assert second["coalesced"] and second["id"] == first["id"]
+		assert server.events(first["id"])[-1] == {"status": "done"}
+
+	assert len(server.server.jobs) == 1
+	assert len(pagesServed(standin)) == 3
+
+def test_concurrent_extractions_of_a_course_are_shared(server):
+	with StandinServer(codelabs=3, delay=0.1) as standin:
+		first = server.create_job(course=standin.codelab_url(1), formats=["md"])
+		second = server.create_job(course=standin.codelab_url(1), formats=["html"])
+		assert first["id"] != second["id"]
+		first_events, second_events = server.events(first["id"]), server.events(second["id"])
+
+	assert first_events[-1] == second_events[-1] == {"status": "done"}
+	assert {"stage": "Waiting", "detail": standin.codelab_url(1)} in second_events
+	# every page was downloaded once, by the first job
+	assert len(pagesServed(standin)) == 3
+
+	third = server.create_job(course=standin.codelab_url(1), formats=["repr"])
+	assert {"stage": "Cached", "detail": standin.codelab_url(1)} in server.events(third["id"])
+
+def test_images_are_shared_between_courses(server):
+	with StandinServer(codelabs=3, images=2) as standin:
+		first = server.create_job(course=standin.codelab_url(1), formats=["html"], download_images=True)
+		server.events(first["id"])
+		# a different count is a different course, but its pages and images are already cached
+		second = server.create_job(course=standin.codelab_url(1), formats=["html"], download_images=True, count=2)
+		assert server.events(second["id"])[-1] == {"status": "done"}
+
+	images = [path for path in standin.served if "/img/" in path]
+	assert len(images) == 6 and len(set(images)) == 6
+	names = zipfile.ZipFile(io.BytesIO(server.request("GET", f"/jobs/{second['id']}/bundle")[1])).namelist()
+	assert len([name for name in names if name.startswith("html/images/")]) == 4
+
+def test_only_old_finished_jobs_are_forgotten(metrics):
+	server = ServerThread(job_history_size=1)
+	try:
+		with StandinServer(codelabs=2, delay=0.2) as standin:
+			first = server.create_job(course=standin.codelab_url(1), formats=["md"])
+			second = server.create_job(course=standin.codelab_url(1), formats=["html"])
+			# both are running, so neither is forgotten even if the history is full
+			assert server.request("GET", f"/jobs/{first['id']}")[0] == 200
+			assert server.request("GET", f"/jobs/{second['id']}")[0] == 200
+			# streamed at the same time, since whichever finishes first is forgotten when the other finishes
+			with ThreadPoolExecutor() as executor:
+				events = list(executor.map(server.events, [first["id"], second["id"]]))
+			assert events[0][-1] == events[1][-1] == {"status": "done"}
+
+			third = server.create_job(course=standin.codelab_url(1), formats=["repr"])
+			server.events(third["id"])
+
+		assert server.request("GET", f"/jobs/{first['id']}")[0] == 404
+		assert server.request("GET", f"/jobs/{second['id']}")[0] == 404
+		assert server.request("GET", f"/jobs/{third['id']}/bundle")[0] == 200
+	finally:
+		server.close()
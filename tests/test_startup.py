@@ -0,0 +1,63 @@
+from standin_server import StandinServer
+import os
+import subprocess
+import sys
+import pytest
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# cumulative import time of the codelabs_extractor modules imported by `--help`; it was
+# about 160ms when bs4 and urllib.request were imported eagerly, and is about 15ms now
+IMPORT_TIME_BUDGET_US = 60000
+
+def runPython(*args):
+	return subprocess.run([sys.executable, *args], cwd=REPOSITORY_DIRECTORY, capture_output=True, text=True)
+
+def importTimes(*args):
+	"""Returns {module: cumulative import time in us} for the modules imported directly by `python -X importtime *args`"""
+	runPython(*args) # so that bytecode compilation is not measured
+	result = runPython("-X", "importtime", *args)
+	times = {}
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:"):
+			continue
+		_, cumulative, module = line.split("|")
+		if cumulative.strip().isdigit():
+			times[module.rstrip()] = int(cumulative)
+	return times
+
+def test_help_imports_little():
+	times = importTimes("-m", "codelabs_extractor", "--help")
+	modules = [module.strip() for module in times]
+
+	assert "codelabs_extractor.course_extractor" in modules
+	for heavy in ["bs4", "urllib.request", "codelabs_extractor.codelab_extractor", "codelabs_extractor.scheduler"]:
+		assert heavy not in modules
+
+	# top level modules are indented by a single space, their cumulative time includes their imports
+	total = sum([time for module, time in times.items() if module.startswith(" codelabs_extractor")])
+	assert total < IMPORT_TIME_BUDGET_US, f"importing codelabs_extractor took {total}us"
+
+def test_render_saved_course_without_bs4(tmp_path):
+	pytest.importorskip("bs4")
+	from codelabs_extractor.course_extractor import CourseExtractor
+
+	with StandinServer(codelabs=3) as server:
+		course = CourseExtractor(server.codelab_url(1), "kotlin", 999999, None)
+	course.save(str(tmp_path / "course.pickle"))
+
+	# importing a module set to None in sys.modules raises ImportError
+	result = runPython("-c", f"""if True:
+		import sys
+		sys.modules["bs4"] = None
+		sys.modules["urllib.request"] = None
+		from codelabs_extractor.course_extractor import CourseExtractor
+		course = CourseExtractor.load({str(tmp_path / "course.pickle")!r},
+			CourseExtractor.extraction_arguments({server.codelab_url(1)!r}, "kotlin", 999999, False))
+		for format in ["repr", "md", "html", "pandoc"]:
+			course.export(format, {str(tmp_path)!r} + "/" + format)
+		""")
+	assert result.returncode == 0, result.stderr
+
+	assert sorted(os.listdir(tmp_path / "md")) == ["0.md", "1.md", "2.md"]
+	assert "```kotlin" in (tmp_path / "md" / "1.md").read_text()
+	assert "<a href=\"./2.html\">" in (tmp_path / "html" / "1.html").read_text()